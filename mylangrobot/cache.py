@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+import cv2
+import numpy as np
+from pydantic import BaseModel, TypeAdapter
+
+from .utils import get_cache_directory
+
+
+class ResponseCacheSettings(BaseModel):
+    enabled: bool = False
+    path: Optional[str] = None  # defaults to the user cache directory
+    ttl: float = 7 * 24 * 60 * 60  # [s]
+    max_entries: int = 128
+    min_confidence: float = 0.9
+    max_centroid_shift: float = 0.1  # mean centroid shift with zero confidence, relative to the image size
+
+    @property
+    def full_path(self) -> str:
+        return self.path or os.path.join(get_cache_directory("mylangrobot"), "response_cache.json")
+
+
+def normalize_command(text: str) -> str:
+    """Normalize command text so that trivial differences in width, case and spacing are ignored."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return " ".join(text.split()).rstrip(".!?。！？ ")
+
+
+def perceptual_hash(image: np.ndarray) -> str:
+    """Calculate 64 bits DCT perceptual hash of image as a hex string."""
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    resized = cv2.resize(image, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low_freq = cv2.dct(resized)[:8, :8].flatten()
+    bits = low_freq > np.median(low_freq[1:])
+    return "{:016x}".format(int("".join("1" if b else "0" for b in bits), 2))
+
+
+class SceneSignature(BaseModel):
+    num_objects: int
+    centroids: list[list[float]]  # (row, col) of each mask in label order, relative to the image size
+    image_hash: str
+
+    @classmethod
+    def from_detections(cls, annotated_image: np.ndarray, masks: np.ndarray) -> "SceneSignature":
+        """Create scene signature from annotated image and masks of detections.
+
+        Note: The order of the centroids follows the labels on the annotated image,
+        since the cached response refers to the objects by these labels.
+        """
+        height, width = annotated_image.shape[:2]
+        centroids = [
+            (np.mean(np.where(mask == True), axis=1) / np.array([height, width])).tolist() for mask in masks
+        ]
+        return cls(num_objects=len(masks), centroids=centroids, image_hash=perceptual_hash(annotated_image))
+
+    def similarity(self, other: "SceneSignature", max_centroid_shift: float) -> float:
+        """Return confidence in [0, 1] that two signatures describe the same scene."""
+        if self.num_objects != other.num_objects:
+            return 0.0
+        if self.num_objects == 0:
+            layout_confidence = 1.0
+        else:
+            shift = np.mean(np.linalg.norm(np.array(self.centroids) - np.array(other.centroids), axis=1))
+            layout_confidence = max(0.0, 1.0 - shift / max_centroid_shift)
+        hamming = bin(int(self.image_hash, 16) ^ int(other.image_hash, 16)).count("1")
+        hash_confidence = 1.0 - hamming / 64
+        return float(min(layout_confidence, hash_confidence))
+
+
+class CacheEntry(BaseModel):
+    command: str
+    signature: SceneSignature
+    response: str
+    created_at: float
+
+
+class ResponseCache:
+    """LLM response cache keyed by normalized command text and scene signature.
+
+    Entries expire after ttl seconds and the least recently used entry is evicted when the cache is full.
+    A response is reused when the command matches exactly and the scene is similar with at least min_confidence.
+    The cache is saved to a json file on every change and loaded on construction.
+    """
+
+    def __init__(self, **kwargs):
+        settings = ResponseCacheSettings(**kwargs)
+        self._path = settings.full_path
+        self._ttl = settings.ttl
+        self._max_entries = settings.max_entries
+        self._min_confidence = settings.min_confidence
+        self._max_centroid_shift = settings.max_centroid_shift
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+        self.load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(command: str, signature: SceneSignature) -> str:
+        return hashlib.sha256((command + "\n" + signature.model_dump_json()).encode("utf-8")).hexdigest()
+
+    def _remove_expired(self) -> bool:
+        now = time.time()
+        expired = [key for key, entry in self._entries.items() if now - entry.created_at > self._ttl]
+        for key in expired:
+            del self._entries[key]
+        return len(expired) > 0
+
+    def _find(self, command: str, signature: SceneSignature) -> tuple[Optional[str], float]:
+        command = normalize_command(command)
+        best_key, best_confidence = None, 0.0
+        for key, entry in self._entries.items():
+            if entry.command != command:
+                continue
+            confidence = entry.signature.similarity(signature, self._max_centroid_shift)
+            if confidence > best_confidence:
+                best_key, best_confidence = key, confidence
+        return best_key, best_confidence
+
+    def get(self, command: str, signature: SceneSignature) -> Optional[str]:
+        with self._lock:
+            if self._remove_expired():
+                self._save()
+            key, confidence = self._find(command, signature)
+            if key is None or confidence < self._min_confidence:
+                return None
+            print("[ResponseCache] Hit (confidence: {:.3f})".format(confidence))
+            self._entries.move_to_end(key)
+            return self._entries[key].response
+
+    def put(self, command: str, signature: SceneSignature, response: str) -> None:
+        command = normalize_command(command)
+        with self._lock:
+            self._remove_expired()
+            key = self._key(command, signature)
+            self._entries[key] = CacheEntry(
+                command=command, signature=signature, response=response, created_at=time.time()
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def invalidate(self, command: str, signature: SceneSignature) -> int:
+        """Remove the entries that would be returned for command and signature, e.g. after the plan failed.
+
+        Returns the number of removed entries.
+        """
+        with self._lock:
+            removed = 0
+            while True:
+                key, confidence = self._find(command, signature)
+                if key is None or confidence < self._min_confidence:
+                    break
+                del self._entries[key]
+                removed += 1
+            if removed > 0:
+                print("[ResponseCache] Invalidated {} entries".format(removed))
+                self._save()
+            return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._save()
+
+    def load(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if not os.path.exists(self._path):
+                return
+            try:
+                with open(self._path, "r", encoding="utf-8") as f:
+                    entries = TypeAdapter(list[CacheEntry]).validate_python(json.load(f))
+            except (OSError, ValueError) as e:
+                print("[ResponseCache] Failed to load {}: {}".format(self._path, e))
+                return
+            for entry in entries:
+                self._entries[self._key(entry.command, entry.signature)] = entry
+            self._remove_expired()
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def _save(self) -> None:
+        # A failure to persist the cache must not abort the command or hide the error of a failed plan.
+        tmp_path = self._path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([entry.model_dump() for entry in self._entries.values()], f, ensure_ascii=False)
+            os.replace(tmp_path, self._path)
+        except OSError as e:
+            print("[ResponseCache] Failed to save {}: {}".format(self._path, e))
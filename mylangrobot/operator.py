@@ -1,3 +1,4 @@
+import asyncio
 import time
 from typing import Callable, Optional
 
@@ -8,10 +9,14 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from .annotator import Annotator
+from .cache import ResponseCache, ResponseCacheSettings, SceneSignature
 from .gpt4v import request_gpt4v
 from .interface import Audio, InterfaceType, Terminal
 from .prompt import ResponseType, get_mycobot_prompt, parse_response
 from .robot_controller import MyCobotController, MyCobotSettings
+from .utils import StageTrace
+
+EXECUTE_CODE_RESPONSE = "<Execute code>"
 
 
 class SOMOperator:
@@ -24,6 +29,7 @@ class SOMOperator:
         mycobot_settings: Optional[MyCobotSettings] = None,
         capture_image_callback: Optional[Callable] = None,
         annotate_image_callback: Optional[Callable] = None,
+        response_cache_settings: Optional[ResponseCacheSettings] = None,
     ):
         self._cap = cv2.VideoCapture(camera_id)
         if interface_type == InterfaceType.TERMINAL:
@@ -34,6 +40,11 @@ class SOMOperator:
             raise ValueError("Invalid interface type {}.".format(interface_type))
         self._annotator = Annotator()
         self._robot_controller = MyCobotController(**(mycobot_settings or MyCobotSettings()).dict())
+        response_cache_settings = response_cache_settings or ResponseCacheSettings()
+        self._response_cache = None
+        if response_cache_settings.enabled:
+            self._response_cache = ResponseCache(**response_cache_settings.dict())
+        self._cache_query: Optional[tuple[str, SceneSignature]] = None
         self._language = language
         self._pixel_size_on_capture_position = pixel_size_on_capture_position
         self._current_frame = None
@@ -112,30 +123,140 @@ class SOMOperator:
                 chat_history.append(res)
                 print(chat_history)
 
+    async def run_async(self):
+        chat_history = []
+        while True:
+            res = await self.run_once_async(chat_history)
+            if res is not None:
+                chat_history.append(res)
+                print(chat_history)
+
     def run_once(self, chat_history: Optional[list] = None) -> Optional[tuple[str, str]]:
         if chat_history is None:
             chat_history = []
-        input_text = self._interface.input(prefix="Me: ")
+        command = self._interface.input()
+        return self.execute_command(
+            self._with_chat_history(command, chat_history), self._cache_command(command, chat_history)
+        )
+
+    async def run_once_async(self, chat_history: Optional[list] = None) -> Optional[tuple[str, str]]:
+        if chat_history is None:
+            chat_history = []
+        # Wait for input directly, since nothing runs concurrently at this point
+        # and a worker thread blocked in input would keep the process alive on Ctrl+C.
+        command = self._interface.input()
+        return await self.execute_command_async(
+            self._with_chat_history(command, chat_history), self._cache_command(command, chat_history)
+        )
+
+    @staticmethod
+    def _with_chat_history(command: str, chat_history: list) -> str:
+        input_text = "Me: " + command
         if chat_history:
             input_text = "\n".join([f"Me: {q}\nYou: {a}" for q, a in chat_history]) + "\n" + input_text
-        return self.execute_command(input_text)
+        return input_text
+
+    @staticmethod
+    def _cache_command(command: str, chat_history: list) -> Optional[str]:
+        # An answer to a clarification question depends on the conversation, so it is not cached.
+        if chat_history and chat_history[-1][1] != EXECUTE_CODE_RESPONSE:
+            return None
+        return command
+
+    def execute_command(self, input_text: str, command: Optional[str] = None) -> Optional[tuple[str, str]]:
+        """Execute command given as input_text, which may contain the chat history.
+
+        command is the current command without the chat history, used as the key of the response cache.
+        The response cache is not used if command is None.
+        """
+        trace = StageTrace()
+        try:
+            with trace.stage("capture"):
+                self.capture()
+            frame, cam_center = self._current_frame, self._cam_center
+            with trace.stage("capture_callback"):
+                self.capture_image_callback(frame)
+            with trace.stage("annotate"):
+                annotated_image, detections = self._annotator.get_annotated_image(frame)
+            with trace.stage("annotate_callback"):
+                self.annotate_image_callback(annotated_image)
+            with trace.stage("request_response"):
+                res, response_type = self.request_response(input_text, annotated_image, detections.mask, command)
+            if response_type == ResponseType.QUESTION:
+                with trace.stage("output"):
+                    self._interface.output(res)
+                return (input_text, res)
+            elif response_type == ResponseType.CODE:
+                obj_centers = self.calc_object_centers(detections.mask, cam_center)
+                with trace.stage("move_home"):
+                    self._robot_controller.move_to_place("home")
+                with trace.stage("execute_code"):
+                    self.execute_code(res, obj_centers)
+                return (input_text, EXECUTE_CODE_RESPONSE)
+            return None
+        finally:
+            print("[SOMOperator] Trace:\n" + trace.report())
 
-    def execute_command(self, input_text: str) -> Optional[tuple[str, str]]:
+    async def execute_command_async(self, input_text: str, command: Optional[str] = None) -> Optional[tuple[str, str]]:
+        """Asynchronous version of `execute_command`.
+
+        Robot I/O, perception, LLM requests and interface output run as tasks,
+        and each stage only waits for the stages it depends on.
+        The arm returns home while the image is segmented and the LLM is thinking,
+        and a question is spoken while the arm is still moving.
+
+        Note:
+            The arm starts returning home before the response type is known, so unlike `execute_command`,
+            it is also at home after a question and the next command drives it back to the capture position.
+            This costs one visible motion per clarification and saves one per program, which is the common case.
+        """
+        trace = StageTrace()
+        tasks = []
+        try:
+            await trace.run("capture", self.capture)
+            frame, cam_center = self._current_frame, self._cam_center
+            tasks.append(asyncio.create_task(trace.run("capture_callback", self.capture_image_callback, frame)))
+            move_home = asyncio.create_task(trace.run("move_home", self._robot_controller.move_to_place, "home"))
+            tasks.append(move_home)
+            annotated_image, detections = await trace.run("annotate", self._annotator.get_annotated_image, frame)
+            tasks.append(
+                asyncio.create_task(trace.run("annotate_callback", self.annotate_image_callback, annotated_image))
+            )
+            res, response_type = await trace.run(
+                "request_response", self.request_response, input_text, annotated_image, detections.mask, command
+            )
+            result = None
+            if response_type == ResponseType.QUESTION:
+                await trace.run("output", self._interface.output, res)
+                result = (input_text, res)
+            elif response_type == ResponseType.CODE:
+                obj_centers = self.calc_object_centers(detections.mask, cam_center)
+                await move_home
+                await trace.run("execute_code", self.execute_code, res, obj_centers)
+                result = (input_text, EXECUTE_CODE_RESPONSE)
+            await asyncio.gather(*tasks)
+            return result
+        finally:
+            # Wait for the background stages even if a stage failed, so that the arm is not left moving.
+            await asyncio.gather(*tasks, return_exceptions=True)
+            print("[SOMOperator] Trace:\n" + trace.report())
+
+    def capture(self):
         self._robot_controller.move_to_place("capture")
         time.sleep(1)
         self.update_current_frame()
-        self.capture_image_callback(self._current_frame)
-        res, response_type, obj_centers = self.process_image(self._current_frame, self._cam_center, input_text)
-        if response_type == ResponseType.QUESTION:
-            self._interface.output(res)
-            return (input_text, res)
-        elif response_type == ResponseType.CODE:
-            self._robot_controller.move_to_place("home")
+
+    def execute_code(self, code: str, obj_centers: list):
+        # Hold the arm for the whole program so that no other task can move it in between.
+        with self._robot_controller.lock:
             self._robot_controller.set_detections(obj_centers)
-            exec(res, self.function_map(), {})
-            self._robot_controller.clear_detections()
-            return (input_text, "<Execute code>")
-        return None
+            try:
+                exec(code, self.function_map(), {})
+            except Exception:
+                self.invalidate_cached_response()
+                raise
+            finally:
+                self._robot_controller.clear_detections()
 
     def process_image(self, image: np.ndarray, cam_center: np.ndarray, text: str) -> tuple[str, ResponseType, list]:
         """Process image and return response text and response type.
@@ -145,17 +266,51 @@ class SOMOperator:
         """
         annotated_image, detections = self._annotator.get_annotated_image(image)
         self.annotate_image_callback(annotated_image)
-        prompt = get_mycobot_prompt(len(detections.mask), self._language).format(text=text)
-        res = request_gpt4v(prompt, annotated_image)
-        res, response_type = parse_response(res)
-        print("[SOMOperator]", response_type, res)
+        res, response_type = self.request_response(text, annotated_image, detections.mask)
         # calculate center of masks
         centers = []
         if response_type == ResponseType.CODE:
-            for mask in detections.mask:
-                center = np.mean(np.where(mask == True), axis=1)
-                centers.append(self._pixel_size_on_capture_position * (center - cam_center))
+            centers = self.calc_object_centers(detections.mask, cam_center)
         return res, response_type, centers
 
+    def request_response(
+        self, text: str, annotated_image: np.ndarray, masks: np.ndarray, command: Optional[str] = None
+    ) -> tuple[str, ResponseType]:
+        """Request response for annotated image to GPT-4V, reusing a cached plan for the same command and scene.
+
+        The cache is keyed by command instead of text, since text may contain the chat history.
+        """
+        self._cache_query = None
+        if self._response_cache is not None and command is not None:
+            signature = SceneSignature.from_detections(annotated_image, masks)
+            self._cache_query = (command, signature)
+            res = self._response_cache.get(command, signature)
+            if res is not None:
+                res, response_type = parse_response(res)
+                print("[SOMOperator] (cached)", response_type, res)
+                return res, response_type
+        prompt = get_mycobot_prompt(len(masks), self._language).format(text=text)
+        raw_res = request_gpt4v(prompt, annotated_image)
+        res, response_type = parse_response(raw_res)
+        print("[SOMOperator]", response_type, res)
+        # Questions depend on the conversation, so only plans are cached.
+        if self._cache_query is not None and response_type == ResponseType.CODE:
+            self._response_cache.put(*self._cache_query, raw_res)
+        return res, response_type
+
+    def invalidate_cached_response(self):
+        """Invalidate the cached response of the last command, e.g. when its plan failed."""
+        if self._response_cache is not None and self._cache_query is not None:
+            self._response_cache.invalidate(*self._cache_query)
+            self._cache_query = None
+
+    def calc_object_centers(self, masks: np.ndarray, cam_center: np.ndarray) -> list:
+        """Calculate the centers of masks relative to the camera center in meters."""
+        centers = []
+        for mask in masks:
+            center = np.mean(np.where(mask == True), axis=1)
+            centers.append(self._pixel_size_on_capture_position * (center - cam_center))
+        return centers
+
     def save_current_image(self, filename: str):
         cv2.imwrite(filename, self._current_frame)
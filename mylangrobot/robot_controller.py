@@ -1,4 +1,5 @@
 import os
+import threading
 import time
 from typing import Optional
 
@@ -49,6 +50,14 @@ class MyCobotController:
         self.object_height = settings.object_height
         self.release_height = settings.release_height
         self._detections = []
+        # Guards the arm state so that concurrent tasks cannot issue conflicting moves.
+        # Reentrant because composite motions (e.g. grab) call other motions.
+        self._lock = threading.RLock()
+
+    @property
+    def lock(self) -> threading.RLock:
+        """Lock to hold while issuing a sequence of motions that must not be interleaved."""
+        return self._lock
 
     def _calc_camera_lens_coords_on_capture_position(self, urdf_path: str) -> kp.Transform:
         sim_for_lens = kp.build_serial_chain_from_urdf(open(urdf_path).read(), "camera_lens")
@@ -84,26 +93,29 @@ class MyCobotController:
 
     def move_to_xy(self, x: float, y: float, speed: Optional[float] = None) -> None:
         """Move to absolute position xy"""
-        coords = self.current_coords()
-        coords.pos[0] = x
-        coords.pos[1] = y
-        self.move_to_coords(coords, speed)
+        with self._lock:
+            coords = self.current_coords()
+            coords.pos[0] = x
+            coords.pos[1] = y
+            self.move_to_coords(coords, speed)
 
     def move_to_z(self, z: float, speed: Optional[float] = None) -> None:
         """Move to absolute position z"""
-        coords = self.current_coords()
-        coords.pos[2] = z
-        self.move_to_coords(coords, speed or self._default_z_speed)
+        with self._lock:
+            coords = self.current_coords()
+            coords.pos[2] = z
+            self.move_to_coords(coords, speed or self._default_z_speed)
 
     def move_to_coords(self, coords: kp.Transform, speed: Optional[float] = None) -> None:
-        position = self._sim.inverse_kinematics(coords, np.deg2rad(self._current_position))
-        self._current_position = np.rad2deg(position)
-        self._mycobot.sync_send_angles(
-            self._current_position + self.calc_gravity_compensation(self._current_position),
-            speed or self._default_speed,
-            self._command_timeout,
-        )
-        print("Current coords: {}".format(self.current_coords()))
+        with self._lock:
+            position = self._sim.inverse_kinematics(coords, np.deg2rad(self._current_position))
+            self._current_position = np.rad2deg(position)
+            self._mycobot.sync_send_angles(
+                self._current_position + self.calc_gravity_compensation(self._current_position),
+                speed or self._default_speed,
+                self._command_timeout,
+            )
+            print("Current coords: {}".format(self.current_coords()))
 
     def move_to_object(self, object_no: int, speed: Optional[float] = None) -> None:
         object_no = self._check_and_correct_object_no(object_no)
@@ -115,27 +127,30 @@ class MyCobotController:
         self.move_to_xy(detection[0], detection[1], speed)
 
     def move_to_place(self, place_name: str, speed: Optional[float] = None) -> None:
-        print("[MyCobotController] Move to Place {}".format(place_name))
-        self._current_position = self.positions[place_name]
-        self._mycobot.sync_send_angles(
-            np.array(self._current_position) + self.calc_gravity_compensation(self._current_position),
-            speed or self._default_speed,
-            self._command_timeout,
-        )
-        print("Current coords: {}".format(self.current_coords()))
+        with self._lock:
+            print("[MyCobotController] Move to Place {}".format(place_name))
+            self._current_position = self.positions[place_name]
+            self._mycobot.sync_send_angles(
+                np.array(self._current_position) + self.calc_gravity_compensation(self._current_position),
+                speed or self._default_speed,
+                self._command_timeout,
+            )
+            print("Current coords: {}".format(self.current_coords()))
 
     def grab(self, speed: Optional[float] = None) -> None:
-        print("[MyCobotController] Grab to Object")
-        current_pos = self.current_coords().pos
-        self.move_to_z(self.object_height + self.end_effector_height, speed)
-        self._mycobot.set_basic_output(self._suction_pin, 0)
-        time.sleep(2)
-        self.move_to_z(current_pos[2], speed)
+        with self._lock:
+            print("[MyCobotController] Grab to Object")
+            current_pos = self.current_coords().pos
+            self.move_to_z(self.object_height + self.end_effector_height, speed)
+            self._mycobot.set_basic_output(self._suction_pin, 0)
+            time.sleep(2)
+            self.move_to_z(current_pos[2], speed)
 
     def release(self, speed: Optional[float] = None) -> None:
-        print("[MyCobotController] Release")
-        current_pos = self.current_coords().pos
-        self.move_to_z(self.release_height + self.end_effector_height, speed)
-        self._mycobot.set_basic_output(self._suction_pin, 1)
-        time.sleep(1)
-        self.move_to_z(current_pos[2], speed)
+        with self._lock:
+            print("[MyCobotController] Release")
+            current_pos = self.current_coords().pos
+            self.move_to_z(self.release_height + self.end_effector_height, speed)
+            self._mycobot.set_basic_output(self._suction_pin, 1)
+            time.sleep(1)
+            self.move_to_z(current_pos[2], speed)
@@ -1,5 +1,9 @@
+import asyncio
 import os
 import platform
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
 
 import requests
 from tqdm import tqdm
@@ -50,3 +54,45 @@ def download_sam_model_to_cache(app_name: str, url: str = SAM_WEIGHTS_URL) -> st
     if total_size != 0 and progress_bar.n != total_size:
         raise RuntimeError("Failed to download file")
     return file_path
+
+
+class StageTrace:
+    """Record the wall-clock span of each stage of a command.
+
+    `execute_command` and `execute_command_async` record the same stage names,
+    so the real reduction is the difference between the wall times of the two traces.
+    The sum of the stage durations is only an estimate of the serial time,
+    since overlapping stages (e.g. SAM and the serial port I/O sharing the GIL) run slower than alone.
+    """
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self.spans: list[tuple[str, float, float]] = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter() - self._start
+        try:
+            yield
+        finally:
+            self.spans.append((name, start, time.perf_counter() - self._start))
+
+    async def run(self, name: str, func: Callable, *args, **kwargs) -> Any:
+        """Run func in a worker thread as a stage, so that stages started as separate tasks overlap."""
+        with self.stage(name):
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    def report(self) -> str:
+        wall_time = time.perf_counter() - self._start
+        stage_time = sum(end - start for _, start, end in self.spans)
+        lines = [
+            "{:<20} {:6.2f}s -> {:6.2f}s ({:.2f}s)".format(name, start, end, end - start)
+            for name, start, end in sorted(self.spans, key=lambda span: span[1])
+        ]
+        # Work between stages is not in any span, so the estimate is clamped for serial traces.
+        lines.append(
+            "wall time: {:.2f}s, sum of stages: {:.2f}s, overlapped (estimate): {:.2f}s".format(
+                wall_time, stage_time, max(0.0, stage_time - wall_time)
+            )
+        )
+        return "\n".join(lines)
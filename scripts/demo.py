@@ -1,7 +1,9 @@
 import argparse
+import asyncio
 
 import yaml
 
+from mylangrobot.cache import ResponseCacheSettings
 from mylangrobot.operator import SOMOperator
 from mylangrobot.interface import InterfaceType
 from mylangrobot.robot_controller import MyCobotSettings
@@ -10,12 +12,14 @@ from mylangrobot.robot_controller import MyCobotSettings
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", type=str, default="../configs/settings.yml")
+    parser.add_argument("--use-async", action="store_true", help="Overlap robot motion, LLM inference and output")
     args = parser.parse_args()
 
     with open(args.config, "r") as f:
         config = yaml.safe_load(f)
 
     mycobot_settings = MyCobotSettings(**config["mycobot_settings"])
+    response_cache_settings = ResponseCacheSettings(**config.get("response_cache", {}))
 
     som = SOMOperator(
         pixel_size_on_capture_position=config["pixel_size_on_capture_position"],
@@ -23,5 +27,9 @@ if __name__ == "__main__":
         camera_id=config["camera_id"],
         language=config["language"],
         mycobot_settings=mycobot_settings,
+        response_cache_settings=response_cache_settings,
     )
-    som.run()
+    if args.use_async:
+        asyncio.run(som.run_async())
+    else:
+        som.run()